@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import os
+
 from distutils.core import setup
 from catkin_pkg.python_setup import generate_distutils_setup
 
@@ -8,4 +10,9 @@ d = generate_distutils_setup(
     package_dir={'': 'src'},
     )
 
+# The compiled parser and framer helpers are optional; SerialClient falls back to pure Python.
+if os.environ.get('ROSSERIAL_PYTHON_CYTHON'):
+    from Cython.Build import cythonize
+    d['ext_modules'] = cythonize('src/rosserial_python/_serial_client_core.pyx', language_level=3)
+
 setup(**d)
@@ -33,14 +33,13 @@
 
 __author__ = "mferguson@willowgarage.com (Michael Ferguson)"
 
-import array
+import collections
 import errno
-import imp
+import functools
+import importlib.util
 import io
 import multiprocessing
-import queue
 import socket
-import struct
 import sys
 import threading
 import time
@@ -62,26 +61,43 @@ ERROR_PACKET_FAILED = "Packet Failed : Failed to read msg data"
 
 MAX_UDP_PACKET_SIZE = 508
 
+# queued on shutdown to end SerialClient's write thread
+WRITE_QUEUE_STOP = object()
+
+PROTOCOL_VER_MSGS = {
+    b'\xff': 'Rev 0 (rosserial 0.4 and earlier)',
+    b'\xfe': 'Rev 1 (rosserial 0.5+)',
+    b'\xfd': 'Some future rosserial version'
+}
+
+try:
+    # compiled parser and framer helpers, built when ROSSERIAL_PYTHON_CYTHON is set
+    from rosserial_python._serial_client_core import sum_bytes, unpack_length, unpack_topic, append_frame
+except ImportError:
+    from rosserial_python._serial_client_fallback import sum_bytes, unpack_length, unpack_topic, append_frame
+
 def load_pkg_module(package, directory):
     #check if its in the python path
     path = sys.path
-    try:
-        imp.find_module(package)
-    except ImportError:
+    if importlib.util.find_spec(package) is None:
         roslib.load_manifest(package)
     try:
         m = __import__( package + '.' + directory )
     except ImportError:
-        rospy.logerr( "Cannot import package : %s"% package )
-        rospy.logerr( "sys.path was " + str(path) )
+        rospy.logerr( "Cannot import package : %s", package )
+        rospy.logerr( "sys.path was %s", path )
         return None
     return m
 
+# message and service classes are looked up again each time the device
+# (re)negotiates its topics, so cache them; failed lookups raise and are retried
+@functools.lru_cache(maxsize=None)
 def load_message(package, message):
     m = load_pkg_module(package, 'msg')
     m2 = getattr(m, 'msg')
     return getattr(m2, message)
 
+@functools.lru_cache(maxsize=None)
 def load_service(package,service):
     s = load_pkg_module(package, 'srv')
     s = getattr(s, 'srv')
@@ -90,6 +106,13 @@ def load_service(package,service):
     mres = getattr(s, service+"Response")
     return srv,mreq,mres
 
+def serialize_message(msg):
+    """ Serialize a ROS message to bytes. A fresh BytesIO hands its buffer to
+        getvalue() without copying, which a pooled buffer could not do. """
+    data_buffer = io.BytesIO()
+    msg.serialize(data_buffer)
+    return data_buffer.getvalue()
+
 @contextmanager
 def acquire_timeout(lock, timeout):
     result = lock.acquire(timeout=timeout)
@@ -100,6 +123,29 @@ def acquire_timeout(lock, timeout):
             lock.release()
 
 
+class BufferWriter:
+    """
+        BufferWriter is a file-like target for serialize() that writes into a bytearray
+        kept across messages, so it stops reallocating once it fits the largest message.
+    """
+    def __init__(self, capacity=0):
+        self.buffer = bytearray(capacity)
+        self.size = 0
+
+    def reset(self):
+        self.size = 0
+
+    def write(self, data):
+        # assigning over the existing length overwrites in place, beyond it the buffer grows
+        end = self.size + len(data)
+        self.buffer[self.size:end] = data
+        self.size = end
+        return len(data)
+
+    def getvalue(self):
+        return bytes(memoryview(self.buffer)[:self.size])
+
+
 class Publisher:
     """
         Publisher forwards messages from the serial device to ROS.
@@ -116,12 +162,15 @@ class Publisher:
         else:
             raise Exception('Checksum does not match: ' + self.message._md5sum + ',' + topic_info.md5sum)
 
+        # deserialize overwrites every field and publish serializes before returning,
+        # so one instance can carry every packet
+        self.msg = self.message()
+
     def handlePacket(self, data):
         """ Forward message to ROS network. """
         try:
-            m = self.message()
-            m.deserialize(data)
-            self.publisher.publish(m)
+            self.msg.deserialize(data)
+            self.publisher.publish(self.msg)
         except Exception as e:
             rospy.logerr("Publisher handling packet failed: %s", e)
 
@@ -146,9 +195,7 @@ class Subscriber:
 
     def callback(self, msg):
         """ Forward message to serial device. """
-        data_buffer = io.BytesIO()
-        msg.serialize(data_buffer)
-        self.parent.send(self.id, data_buffer.getvalue())
+        self.parent.send(self.id, serialize_message(msg))
 
     def unregister(self):
         rospy.loginfo("Removing subscriber: %s", self.topic)
@@ -162,18 +209,17 @@ class ServiceServer:
     def __init__(self, topic_info, parent):
         self.topic = topic_info.topic_name
         self.parent = parent
+        # id of the device side subscriber, assigned when it is negotiated
+        self.id = None
 
         # find message type
         package, service = topic_info.message_type.split('/')
-        s = load_pkg_module(package, 'srv')
-        s = getattr(s, 'srv')
-        self.mreq = getattr(s, service+"Request")
-        self.mres = getattr(s, service+"Response")
-        srv = getattr(s, service)
+        srv, self.mreq, self.mres = load_service(package, service)
         self.service = rospy.Service(self.topic, srv, self.callback)
 
         # response message
         self.data = None
+        self.response_event = threading.Event()
 
     def unregister(self):
         rospy.loginfo("Removing service: %s", self.topic)
@@ -181,12 +227,14 @@ class ServiceServer:
 
     def callback(self, req):
         """ Forward request to serial device. """
-        data_buffer = io.BytesIO()
-        req.serialize(data_buffer)
+        if self.id is None:
+            rospy.logerr("Service %s is not set up on the device yet", self.topic)
+            return None
         self.response = None
-        self.parent.send(self.id, data_buffer.getvalue())
-        while self.response is None:
-            pass
+        self.response_event.clear()
+        self.parent.send(self.id, serialize_message(req))
+        if not self.response_event.wait(timeout=self.parent.timeout):
+            rospy.logerr("Timed out waiting for response on service %s", self.topic)
         return self.response
 
     def handlePacket(self, data):
@@ -195,6 +243,7 @@ class ServiceServer:
             r = self.mres()
             r.deserialize(data)
             self.response = r
+            self.response_event.set()
         except Exception as e:
             rospy.logerr("Service server handling packet failed: %s", e)
 
@@ -207,29 +256,28 @@ class ServiceClient:
     def __init__(self, topic_info, parent):
         self.topic = topic_info.topic_name
         self.parent = parent
+        # id of the device side subscriber, assigned when it is negotiated
+        self.id = None
 
         # find message type
         package, service = topic_info.message_type.split('/')
-        s = load_pkg_module(package, 'srv')
-        s = getattr(s, 'srv')
-        self.mreq = getattr(s, service+"Request")
-        self.mres = getattr(s, service+"Response")
-        srv = getattr(s, service)
-        rospy.loginfo("Starting service client, waiting for service '" + self.topic + "'")
+        srv, self.mreq, self.mres = load_service(package, service)
+        rospy.loginfo("Starting service client, waiting for service '%s'", self.topic)
         rospy.wait_for_service(self.topic)
         self.proxy = rospy.ServiceProxy(self.topic, srv)
 
     def handlePacket(self, data):
         """ Forward request to ROS network. """
+        if self.id is None:
+            rospy.logerr("Service %s response is not set up on the device yet", self.topic)
+            return
         try:
             req = self.mreq()
             req.deserialize(data)
             # call service proxy
             resp = self.proxy(req)
             # serialize and publish
-            data_buffer = io.BytesIO()
-            resp.serialize(data_buffer)
-            self.parent.send(self.id, data_buffer.getvalue())
+            self.parent.sendPriority(self.id, serialize_message(resp))
         except Exception as e:
             rospy.logerr("Service client handling packet failed: %s", e)
 
@@ -242,9 +290,12 @@ class RosSerialServer:
         operations (e.g. publish/subscribe) from its connection to the rest of ros.
     """
     def __init__(self, tcp_portnum, fork_server=False):
-        rospy.loginfo("Fork_server is: %s" % fork_server)
+        rospy.loginfo("Fork_server is: %s", fork_server)
         self.tcp_portnum = tcp_portnum
         self.fork_server = fork_server
+        # socket reads land here directly, grown if a larger read is requested
+        self.read_buffer = bytearray(65536)
+        self.read_view = memoryview(self.read_buffer)
 
     def listen(self):
         self.serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -252,11 +303,11 @@ class RosSerialServer:
         # get buffer size
         rospy.loginfo("Getting socket buffer size")
         bufsize = self.serversocket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
-        rospy.loginfo("Socket buffer size: %d bytes" % bufsize)
+        rospy.loginfo("Socket buffer size: %d bytes", bufsize)
         # increase socket buffer size to 500KB
         self.serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 512000)
         newbufsize = self.serversocket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
-        rospy.loginfo("New Socket buffer size: %d bytes" % newbufsize)
+        rospy.loginfo("New Socket buffer size: %d bytes", newbufsize)
         #bind the socket to a public host, and a well-known port
         self.serversocket.bind(("", self.tcp_portnum)) #become a server socket
         self.serversocket.listen(1)
@@ -271,7 +322,7 @@ class RosSerialServer:
                 continue
 
             #now do something with the clientsocket
-            rospy.loginfo("Established a socket connection from %s on port %s" % address)
+            rospy.loginfo("Established a socket connection from %s on port %s", *address)
             self.socket = clientsocket
             self.socket.settimeout(5.0)
             self.isConnected = True
@@ -292,7 +343,7 @@ class RosSerialServer:
         try:
             client.run()
         except KeyboardInterrupt as e:
-            rospy.loginfo(f"{e}")
+            rospy.loginfo("%s", e)
         except RuntimeError:
             rospy.loginfo("RuntimeError exception caught")
             self.isConnected = False
@@ -308,7 +359,7 @@ class RosSerialServer:
                 srv.unregister()
 
     def startSocketServer(self, port, address):
-        rospy.loginfo("starting ROS Serial Python Node serial_node-%r" % address)
+        rospy.loginfo("starting ROS Serial Python Node serial_node-%r", address)
         rospy.init_node("serial_node_%r" % address)
         self.startSerialClient()
 
@@ -332,11 +383,18 @@ class RosSerialServer:
         if not self.isConnected:
             return self.msg
 
-        while len(self.msg) < rqsted_length:
-            chunk = self.socket.recv(rqsted_length - len(self.msg))
-            if chunk == b'':
+        if rqsted_length > len(self.read_buffer):
+            self.read_view.release()
+            self.read_buffer = bytearray(rqsted_length)
+            self.read_view = memoryview(self.read_buffer)
+
+        filled = 0
+        while filled < rqsted_length:
+            received = self.socket.recv_into(self.read_view[filled:rqsted_length])
+            if received == 0:
                 raise RuntimeError("RosSerialServer.read() socket connection broken")
-            self.msg = self.msg + chunk
+            filled += received
+        self.msg = bytes(self.read_view[:rqsted_length])
         return self.msg
 
     def inWaiting(self):
@@ -354,11 +412,14 @@ class RosSerialUDPServer:
         uses it as a serial port. It listens for additional packets. Each process proxies ROS
         operations (e.g. publish/subscribe) from its connection to the rest of ROS.
     """
+    # SerialClient keeps coalesced writes within a datagram where it can
+    max_write_size = MAX_UDP_PACKET_SIZE
+
     def __init__(self, udp_portnum, fork_server=False):
-        rospy.loginfo("Fork_server is: %s" % fork_server)
+        rospy.loginfo("Fork_server is: %s", fork_server)
         self.udp_portnum = udp_portnum
         self.fork_server = fork_server
-        self.recv_buffer  = b'' # Buffer to store leftover data from packets
+        self.recv_buffer  = bytearray() # Buffer to store leftover data from packets
 
     def listen(self):
         self.serversocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -366,14 +427,14 @@ class RosSerialUDPServer:
         # Get buffer size
         rospy.loginfo("Getting socket buffer size")
         bufsize = self.serversocket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
-        rospy.loginfo("Socket buffer size: %d bytes" % bufsize)
+        rospy.loginfo("Socket buffer size: %d bytes", bufsize)
         # Increase socket buffer size to 500KB
         self.serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 512000)
         newbufsize = self.serversocket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
-        rospy.loginfo("New Socket buffer size: %d bytes" % newbufsize)
+        rospy.loginfo("New Socket buffer size: %d bytes", newbufsize)
         # Bind the socket to a public host and a well-known port
         self.serversocket.bind(("", self.udp_portnum))  # become a UDP server socket
-        rospy.loginfo("UDP server listening on port %d" % self.udp_portnum)
+        rospy.loginfo("UDP server listening on port %d", self.udp_portnum)
 
         # Set socket timeout
         self.serversocket.settimeout(5)
@@ -391,7 +452,7 @@ class RosSerialUDPServer:
                 # If this is the first connection, store the address
                 if self.client_address is None:
                     self.client_address = address
-                    rospy.loginfo(f"Client connected from {self.client_address}")
+                    rospy.loginfo("Client connected from %s", self.client_address)
                     self.isConnected = True
 
                 if self.fork_server:  # If configured to launch server in a separate process
@@ -414,7 +475,7 @@ class RosSerialUDPServer:
         try:
             client.run()
         except KeyboardInterrupt as e:
-            rospy.loginfo(f"{e}")
+            rospy.loginfo("%s", e)
         except RuntimeError:
             rospy.loginfo("RuntimeError exception caught")
             self.isConnected = False
@@ -423,12 +484,12 @@ class RosSerialUDPServer:
             rospy.loginfo("Client has exited.")
 
     def startSocketServer(self, address):
-        rospy.loginfo("Starting ROS Serial Python Node serial_node-%r" % address)
+        rospy.loginfo("Starting ROS Serial Python Node serial_node-%r", address)
         rospy.init_node("serial_node_%r" % address)
         self.startSerialClient()
 
     def flushInput(self):
-        self.recv_buffer  = b''
+        del self.recv_buffer[:]
 
     def write(self, data):
         if not self.isConnected or self.client_address is None:
@@ -436,12 +497,13 @@ class RosSerialUDPServer:
 
         total_length = len(data)
         offset = 0
+        view = memoryview(data)  # slicing a view does not copy the data
 
         while offset < total_length:
             # Determine the size of the next chunk
             chunk_size = min(MAX_UDP_PACKET_SIZE, total_length - offset)
-            chunk = data[offset:offset + chunk_size]
-            
+            chunk = view[offset:offset + chunk_size]
+
             try:
                 # Send the chunk to the stored client address
                 self.serversocket.sendto(chunk, self.client_address)
@@ -450,19 +512,21 @@ class RosSerialUDPServer:
                 raise RuntimeError("RosSerialServerUDP.write() socket connection broken")
 
     def read(self, rqsted_length):
-        self.msg = b''  # Buffer to accumulate the received message
+        self.msg = b''
 
         if not self.isConnected or self.client_address is None:
             return self.msg  # Return an empty message if not connected
 
+        buf = bytearray()  # Buffer to accumulate the received message
+
         # First, try to use any leftover data in the internal buffer
         if self.recv_buffer:
             # Calculate how much data can be used from the buffer
             to_read = min(len(self.recv_buffer), rqsted_length)
-            self.msg += self.recv_buffer[:to_read]
-            self.recv_buffer = self.recv_buffer[to_read:]
+            buf += self.recv_buffer[:to_read]
+            del self.recv_buffer[:to_read]
 
-        while len(self.msg) < rqsted_length:
+        while len(buf) < rqsted_length:
             chunk, address = self.serversocket.recvfrom(4096)
 
             # Check if the connection is broken
@@ -474,21 +538,22 @@ class RosSerialUDPServer:
             if address != self.client_address:
                 # If data comes from the same IP but different port, update the client_address
                 if address[0] == self.client_address[0]:
-                    rospy.logwarn(f"Updating client address from {self.client_address} to {address}")
+                    rospy.logwarn("Updating client address from %s to %s", self.client_address, address)
                     self.client_address = address
                 else:
-                    rospy.loginfo(f"Ignoring packet from unauthorized address {address}")
+                    rospy.loginfo("Ignoring packet from unauthorized address %s", address)
                     continue
 
             
-            # Determine how much of the chunk can be added to `self.msg`
-            to_add = rqsted_length - len(self.msg)
-            self.msg += chunk[:to_add]
+            # Determine how much of the chunk can be added to the message
+            to_add = rqsted_length - len(buf)
+            buf += chunk[:to_add]
 
             # Store any remaining data from the chunk in the internal buffer
             if len(chunk) > to_add:
                 self.recv_buffer += chunk[to_add:]
 
+        self.msg = bytes(buf)
         return self.msg
 
     def inWaiting(self):
@@ -501,10 +566,10 @@ class RosSerialUDPServer:
             if address != self.client_address:
                 # If data comes from the same IP but different port, update the client_address
                 if address[0] == self.client_address[0]:
-                    rospy.logwarn(f"Updating client address from {self.client_address} to {address}")
+                    rospy.logwarn("Updating client address from %s to %s", self.client_address, address)
                     self.client_address = address
                 else:
-                    rospy.loginfo(f"Ignoring packet from unauthorized address {address}")
+                    rospy.loginfo("Ignoring packet from unauthorized address %s", address)
 
             self.recv_buffer += chunk
         except BlockingIOError:
@@ -528,12 +593,20 @@ class SerialClient(object):
     def __init__(self, port=None, baud=57600, timeout=5.0, fix_pyserial_for_test=False):
         """ Initialize node, connect to bus, attempt to negotiate topics. """
 
+        # re-entrant: rospy runs the shutdown hook from the SIGINT handler on the main
+        # thread, which may already hold read_lock in run()
         self.read_lock = threading.RLock()
+        self.read_buffer = bytearray()
 
-        self.write_lock = threading.RLock()
-        self.write_queue = queue.Queue()
+        self.write_lock = threading.Lock()
+        # appends and pops on a deque are atomic, write_event wakes the write thread
+        self.write_queue = collections.deque()
+        self.write_event = threading.Event()
         self.write_thread = None
+        self.frame_prefix = self.header + self.protocol_ver
 
+        # bound once, the read loop and every port write stamp the current time
+        self.now = rospy.Time.now
         self.lastsync = rospy.Time(0)
         self.lastsync_lost = rospy.Time(0)
         self.lastsync_success = rospy.Time(0)
@@ -548,12 +621,25 @@ class SerialClient(object):
         self.services = dict()    # topic:Service
         
         def shutdown():
-            self.txStopRequest()
-            rospy.loginfo('shutdown hook activated')
+            try:
+                self.txStopRequest()
+                rospy.loginfo('shutdown hook activated')
+            finally:
+                # the write thread exits once the tx stop request is written, run() joins it
+                self.write_queue.append(WRITE_QUEUE_STOP)
+                self.write_event.set()
         rospy.on_shutdown(shutdown)
         
         self.pub_diagnostics = rospy.Publisher('/diagnostics', diagnostic_msgs.msg.DiagnosticArray, queue_size=10)
 
+        # sendDiagnostics only fills in the changing fields, publish serializes it before returning
+        self.diagnostics_msg = diagnostic_msgs.msg.DiagnosticArray()
+        status = diagnostic_msgs.msg.DiagnosticStatus()
+        status.name = "rosserial_python"
+        status.values.append(diagnostic_msgs.msg.KeyValue(key="last sync"))
+        status.values.append(diagnostic_msgs.msg.KeyValue(key="last sync lost"))
+        self.diagnostics_msg.status.append(status)
+
         if port is None:
             # no port specified, listen for any new port?
             pass
@@ -582,19 +668,24 @@ class SerialClient(object):
         self.buffer_out = -1
         self.buffer_in = -1
 
+        # serializes replies to time and parameter requests, which are only handled on the read thread
+        self.reply_buffer = BufferWriter(256)
+
         self.callbacks = dict()
+        # list indexed lookup for the topic ids devices use in practice, see setCallback
+        self.callback_table = [None] * 1024
         # endpoints for creating new pubs/subs
-        self.callbacks[TopicInfo.ID_PUBLISHER] = self.setupPublisher
-        self.callbacks[TopicInfo.ID_SUBSCRIBER] = self.setupSubscriber
+        self.setCallback(TopicInfo.ID_PUBLISHER, self.setupPublisher)
+        self.setCallback(TopicInfo.ID_SUBSCRIBER, self.setupSubscriber)
         # service client/servers have 2 creation endpoints (a publisher and a subscriber)
-        self.callbacks[TopicInfo.ID_SERVICE_SERVER+TopicInfo.ID_PUBLISHER] = self.setupServiceServerPublisher
-        self.callbacks[TopicInfo.ID_SERVICE_SERVER+TopicInfo.ID_SUBSCRIBER] = self.setupServiceServerSubscriber
-        self.callbacks[TopicInfo.ID_SERVICE_CLIENT+TopicInfo.ID_PUBLISHER] = self.setupServiceClientPublisher
-        self.callbacks[TopicInfo.ID_SERVICE_CLIENT+TopicInfo.ID_SUBSCRIBER] = self.setupServiceClientSubscriber
+        self.setCallback(TopicInfo.ID_SERVICE_SERVER+TopicInfo.ID_PUBLISHER, self.setupServiceServerPublisher)
+        self.setCallback(TopicInfo.ID_SERVICE_SERVER+TopicInfo.ID_SUBSCRIBER, self.setupServiceServerSubscriber)
+        self.setCallback(TopicInfo.ID_SERVICE_CLIENT+TopicInfo.ID_PUBLISHER, self.setupServiceClientPublisher)
+        self.setCallback(TopicInfo.ID_SERVICE_CLIENT+TopicInfo.ID_SUBSCRIBER, self.setupServiceClientSubscriber)
         # custom endpoints
-        self.callbacks[TopicInfo.ID_PARAMETER_REQUEST] = self.handleParameterRequest
-        self.callbacks[TopicInfo.ID_LOG] = self.handleLoggingRequest
-        self.callbacks[TopicInfo.ID_TIME] = self.handleTimeRequest
+        self.setCallback(TopicInfo.ID_PARAMETER_REQUEST, self.handleParameterRequest)
+        self.setCallback(TopicInfo.ID_LOG, self.handleLoggingRequest)
+        self.setCallback(TopicInfo.ID_TIME, self.handleTimeRequest)
 
         rospy.sleep(2.0)
         self.requestTopics()
@@ -607,13 +698,15 @@ class SerialClient(object):
         # TODO remove if possible
         if not self.fix_pyserial_for_test:
             with self.read_lock:
+                del self.read_buffer[:]
                 try:
                     self.port.flushInput()
                 except AttributeError: # socket doesn't have flushInput
                     pass
 
         # request topic sync
-        self.write_queue.put(self.header + self.protocol_ver + b"\x00\x00\xff\x00\x00\xff")
+        self.write_queue.append(self.header + self.protocol_ver + b"\x00\x00\xff\x00\x00\xff")
+        self.write_event.set()
 
     def txStopRequest(self):
         """ Send stop tx request to client before the node exits. """
@@ -624,26 +717,33 @@ class SerialClient(object):
                 except AttributeError: # socket doesn't have flushInput
                     pass
 
-        self.write_queue.put(self.header + self.protocol_ver + b"\x00\x00\xff\x0b\x00\xf4")
+        self.write_queue.append(self.header + self.protocol_ver + b"\x00\x00\xff\x0b\x00\xf4")
+        self.write_event.set()
         rospy.loginfo("Sending tx stop request")
 
     def tryRead(self, length):
+        """ Read length bytes, pulling everything the port has pending into
+            read_buffer so the following fields of a packet need no port access. """
         try:
-            read_start = time.time()
-            bytes_remaining = length
-            result = bytearray()
-            while bytes_remaining != 0 and time.time() - read_start < self.timeout:
+            deadline = time.monotonic() + self.timeout
+            buf = self.read_buffer
+            buffered = len(buf)
+            while len(buf) < length and time.monotonic() < deadline:
                 with self.read_lock:
-                    received = self.port.read(bytes_remaining)
-                if len(received) != 0:
-                    self.last_read = rospy.Time.now()
-                    result.extend(received)
-                    bytes_remaining -= len(received)
+                    received = self.port.read(max(length - len(buf), self.port.inWaiting()))
+                buf.extend(received)
 
-            if bytes_remaining != 0:
-                raise IOError("Returned short (expected %d bytes, received %d instead)." % (length, length - bytes_remaining))
+            if len(buf) != buffered:
+                self.last_read = self.now()
 
-            return bytes(result)
+            if len(buf) < length:
+                raise IOError("Returned short (expected %d bytes, received %d instead)." % (length, len(buf)))
+
+            # copy straight out of the buffer, slicing the bytearray would copy twice
+            result = bytes(memoryview(buf)[:length])
+            # deleting from the front of a bytearray does not move the remaining data
+            del buf[:length]
+            return result
         except Exception as e:
             raise IOError("Serial Port read failure: %s" % e)
 
@@ -660,16 +760,18 @@ class SerialClient(object):
         data = ''
         read_step = None
         while self.write_thread.is_alive() and not rospy.is_shutdown():
-            if (rospy.Time.now() - self.lastsync).to_sec() > (self.timeout * 3):
+            now = self.now()
+            if (now - self.lastsync).to_sec() > (self.timeout * 3):
                 if self.synced:
                     rospy.logerr("Lost sync with device, restarting NOW...")
                     return
                 else:
                     rospy.logerr("Unable to sync with device; possible link problem or link software version mismatch such as hydro rosserial_python with groovy Arduino")
-                self.lastsync_lost = rospy.Time.now()
+                self.lastsync_lost = now
                 self.sendDiagnostics(diagnostic_msgs.msg.DiagnosticStatus.ERROR, ERROR_NO_SYNC)
                 self.requestTopics()
-                self.lastsync = rospy.Time.now()
+                # sendDiagnostics may block (rosserial_arduino resets the board), so restamp
+                self.lastsync = self.now()
 
             # This try-block is here because we make multiple calls to read(). Any one of them can throw
             # an IOError if there's a serial problem or timeout. In that scenario, a single handler at the
@@ -677,7 +779,7 @@ class SerialClient(object):
             try:
                 with acquire_timeout(self.read_lock, 1) as res:
                     if res:
-                        is_empty = self.port.inWaiting() < 1
+                        is_empty = not self.read_buffer and self.port.inWaiting() < 1
                         if is_empty:
                             time.sleep(0.001)
                             continue
@@ -696,33 +798,28 @@ class SerialClient(object):
                 flag[1] = self.tryRead(1)
                 if flag[1] != self.protocol_ver:
                     self.sendDiagnostics(diagnostic_msgs.msg.DiagnosticStatus.ERROR, ERROR_MISMATCHED_PROTOCOL)
-                    rospy.logerr("Mismatched protocol version in packet (%s): lost sync or rosserial_python is from different ros release than the rosserial client" % repr(flag[1]))
-                    protocol_ver_msgs = {
-                            self.protocol_ver1: 'Rev 0 (rosserial 0.4 and earlier)',
-                            self.protocol_ver2: 'Rev 1 (rosserial 0.5+)',
-                            b'\xfd': 'Some future rosserial version'
-                    }
-                    if flag[1] in protocol_ver_msgs:
-                        found_ver_msg = 'Protocol version of client is ' + protocol_ver_msgs[flag[1]]
+                    rospy.logerr_throttle(5, "Mismatched protocol version in packet (%r): lost sync or rosserial_python is from different ros release than the rosserial client", flag[1])
+                    if flag[1] in PROTOCOL_VER_MSGS:
+                        found_ver_msg = 'Protocol version of client is ' + PROTOCOL_VER_MSGS[flag[1]]
                     else:
                         found_ver_msg = "Protocol version of client is unrecognized"
-                    rospy.loginfo("%s, expected %s" % (found_ver_msg, protocol_ver_msgs[self.protocol_ver]))
+                    rospy.loginfo_throttle(5, "%s, expected %s", found_ver_msg, PROTOCOL_VER_MSGS[self.protocol_ver])
                     continue
 
                 # Read message length, checksum (3 bytes)
                 read_step = 'message length'
                 msg_len_bytes = self.tryRead(3)
-                msg_length, _ = struct.unpack("<hB", msg_len_bytes)
+                msg_length, length_ok = unpack_length(msg_len_bytes)
 
                 # Validate message length checksum.
-                if sum(array.array("B", msg_len_bytes)) % 256 != 255:
-                    rospy.loginfo("Wrong checksum for msg length, length %d, dropping message." % (msg_length))
+                if not length_ok:
+                    rospy.loginfo("Wrong checksum for msg length, length %d, dropping message.", msg_length)
                     continue
 
                 # Read topic id (2 bytes)
                 read_step = 'topic id'
                 topic_id_header = self.tryRead(2)
-                topic_id, = struct.unpack("<H", topic_id_header)
+                topic_id = unpack_topic(topic_id_header)
 
                 # Read serialized message data.
                 read_step = 'data'
@@ -738,36 +835,46 @@ class SerialClient(object):
                 # Reada checksum for topic id and msg
                 read_step = 'data checksum'
                 chk = self.tryRead(1)
-                checksum = sum(array.array('B', topic_id_header + msg + chk))
+                checksum = (sum_bytes(topic_id_header) + sum_bytes(msg) + chk[0]) & 0xff
 
                 # Validate checksum.
-                if checksum % 256 == 255:
+                if checksum == 255:
                     self.synced = True
-                    self.lastsync_success = rospy.Time.now()
-                    try:
-                        self.callbacks[topic_id](msg)
-                    except KeyError:
-                        rospy.logerr("Tried to publish before configured, topic id %d" % topic_id)
+                    self.lastsync_success = now
+                    if topic_id < len(self.callback_table):
+                        callback = self.callback_table[topic_id]
+                    else:
+                        callback = self.callbacks.get(topic_id)
+                    if callback is not None:
+                        callback(msg)
+                    else:
+                        rospy.logerr("Tried to publish before configured, topic id %d", topic_id)
                         self.requestTopics()
                     time.sleep(0.001)
                 else:
                     rospy.loginfo("wrong checksum for topic id and msg")
 
             except IOError as exc:
-                rospy.logwarn('Last read step: %s' % read_step)
-                rospy.logwarn('Run loop error: %s' % exc)
+                rospy.logwarn('Last read step: %s', read_step)
+                rospy.logwarn('Run loop error: %s', exc)
                 return
         self.write_thread.join()
 
+    def setCallback(self, topic_id, callback):
+        """ Register the handler for packets received on topic_id. """
+        self.callbacks[topic_id] = callback
+        if topic_id < len(self.callback_table):
+            self.callback_table[topic_id] = callback
+
     def setPublishSize(self, size):
         if self.buffer_out < 0:
             self.buffer_out = size
-            rospy.loginfo("Note: publish buffer size is %d bytes" % self.buffer_out)
+            rospy.loginfo("Note: publish buffer size is %d bytes", self.buffer_out)
 
     def setSubscribeSize(self, size):
         if self.buffer_in < 0:
             self.buffer_in = size
-            rospy.loginfo("Note: subscribe buffer size is %d bytes" % self.buffer_in)
+            rospy.loginfo("Note: subscribe buffer size is %d bytes", self.buffer_in)
 
     def setupPublisher(self, data):
         """ Register a new publisher. """
@@ -776,9 +883,9 @@ class SerialClient(object):
             msg.deserialize(data)
             pub = Publisher(msg)
             if msg.topic_id not in self.publishers:
-                rospy.loginfo("Setup publisher on %s [%s]" % (msg.topic_name, msg.message_type) )
+                rospy.loginfo("Setup publisher on %s [%s]", msg.topic_name, msg.message_type)
             self.publishers[msg.topic_id] = pub
-            self.callbacks[msg.topic_id] = pub.handlePacket
+            self.setCallback(msg.topic_id, pub.handlePacket)
             self.setPublishSize(msg.buffer_size)
             
         except Exception as e:
@@ -789,105 +896,76 @@ class SerialClient(object):
         try:
             msg = TopicInfo()
             msg.deserialize(data)
-            if not msg.topic_name in list(self.subscribers.keys()):
+            if msg.topic_name not in self.subscribers:
                 sub = Subscriber(msg, self)
                 self.subscribers[msg.topic_name] = sub
                 self.setSubscribeSize(msg.buffer_size)
-                rospy.loginfo("Setup subscriber on %s [%s]" % (msg.topic_name, msg.message_type) )
+                rospy.loginfo("Setup subscriber on %s [%s]", msg.topic_name, msg.message_type)
             elif msg.message_type != self.subscribers[msg.topic_name].message._type:
                 old_message_type = self.subscribers[msg.topic_name].message._type
                 self.subscribers[msg.topic_name].unregister()
                 sub = Subscriber(msg, self)
                 self.subscribers[msg.topic_name] = sub
                 self.setSubscribeSize(msg.buffer_size)
-                rospy.loginfo("Change the message type of subscriber on %s from [%s] to [%s]" % (msg.topic_name, old_message_type, msg.message_type) )
+                rospy.loginfo("Change the message type of subscriber on %s from [%s] to [%s]", msg.topic_name, old_message_type, msg.message_type)
         except Exception as e:
             rospy.logerr("Creation of subscriber failed: %s", e)
 
-    def setupServiceServerPublisher(self, data):
-        """ Register a new service server. """
+    def _setupService(self, data, service_class, message_attr, publisher):
+        """
+        Register one endpoint of a service server or client. The device publishes
+        message_attr (mreq or mres) on a publisher endpoint and receives it on a subscriber one.
+        """
+        kind = 'server' if service_class is ServiceServer else 'client'
         try:
             msg = TopicInfo()
             msg.deserialize(data)
-            self.setPublishSize(msg.buffer_size)
+            if publisher:
+                self.setPublishSize(msg.buffer_size)
+            else:
+                self.setSubscribeSize(msg.buffer_size)
             try:
                 srv = self.services[msg.topic_name]
             except KeyError:
-                srv = ServiceServer(msg, self)
-                rospy.loginfo("Setup service server on %s [%s]" % (msg.topic_name, msg.message_type) )
+                srv = service_class(msg, self)
+                rospy.loginfo("Setup service %s on %s [%s]", kind, msg.topic_name, msg.message_type)
                 self.services[msg.topic_name] = srv
-            if srv.mres._md5sum == msg.md5sum:
-                self.callbacks[msg.topic_id] = srv.handlePacket
+            message = getattr(srv, message_attr)
+            if message._md5sum == msg.md5sum:
+                if publisher:
+                    self.setCallback(msg.topic_id, srv.handlePacket)
+                else:
+                    srv.id = msg.topic_id
             else:
-                raise Exception('Checksum does not match: ' + srv.mres._md5sum + ',' + msg.md5sum)
+                raise Exception('Checksum does not match: ' + message._md5sum + ',' + msg.md5sum)
         except Exception as e:
-            rospy.logerr("Creation of service server failed: %s", e)
+            rospy.logerr("Creation of service %s failed: %s", kind, e)
+
+    def setupServiceServerPublisher(self, data):
+        """ Register a new service server. """
+        self._setupService(data, ServiceServer, 'mres', True)
 
     def setupServiceServerSubscriber(self, data):
         """ Register a new service server. """
-        try:
-            msg = TopicInfo()
-            msg.deserialize(data)
-            self.setSubscribeSize(msg.buffer_size)
-            try:
-                srv = self.services[msg.topic_name]
-            except KeyError:
-                srv = ServiceServer(msg, self)
-                rospy.loginfo("Setup service server on %s [%s]" % (msg.topic_name, msg.message_type) )
-                self.services[msg.topic_name] = srv
-            if srv.mreq._md5sum == msg.md5sum:
-                srv.id = msg.topic_id
-            else:
-                raise Exception('Checksum does not match: ' + srv.mreq._md5sum + ',' + msg.md5sum)
-        except Exception as e:
-            rospy.logerr("Creation of service server failed: %s", e)
+        self._setupService(data, ServiceServer, 'mreq', False)
 
     def setupServiceClientPublisher(self, data):
         """ Register a new service client. """
-        try:
-            msg = TopicInfo()
-            msg.deserialize(data)
-            self.setPublishSize(msg.buffer_size)
-            try:
-                srv = self.services[msg.topic_name]
-            except KeyError:
-                srv = ServiceClient(msg, self)
-                rospy.loginfo("Setup service client on %s [%s]" % (msg.topic_name, msg.message_type) )
-                self.services[msg.topic_name] = srv
-            if srv.mreq._md5sum == msg.md5sum:
-                self.callbacks[msg.topic_id] = srv.handlePacket
-            else:
-                raise Exception('Checksum does not match: ' + srv.mreq._md5sum + ',' + msg.md5sum)
-        except Exception as e:
-            rospy.logerr("Creation of service client failed: %s", e)
+        self._setupService(data, ServiceClient, 'mreq', True)
 
     def setupServiceClientSubscriber(self, data):
         """ Register a new service client. """
-        try:
-            msg = TopicInfo()
-            msg.deserialize(data)
-            self.setSubscribeSize(msg.buffer_size)
-            try:
-                srv = self.services[msg.topic_name]
-            except KeyError:
-                srv = ServiceClient(msg, self)
-                rospy.loginfo("Setup service client on %s [%s]" % (msg.topic_name, msg.message_type) )
-                self.services[msg.topic_name] = srv
-            if srv.mres._md5sum == msg.md5sum:
-                srv.id = msg.topic_id
-            else:
-                raise Exception('Checksum does not match: ' + srv.mres._md5sum + ',' + msg.md5sum)
-        except Exception as e:
-            rospy.logerr("Creation of service client failed: %s", e)
+        self._setupService(data, ServiceClient, 'mres', False)
 
     def handleTimeRequest(self, data):
         """ Respond to device with system time. """
+        now = self.now()
         t = Time()
-        t.data = rospy.Time.now()
-        data_buffer = io.BytesIO()
-        t.serialize(data_buffer)
-        self.send( TopicInfo.ID_TIME, data_buffer.getvalue() )
-        self.lastsync = rospy.Time.now()
+        t.data = now
+        self.reply_buffer.reset()
+        t.serialize(self.reply_buffer)
+        self.sendPriority(TopicInfo.ID_TIME, self.reply_buffer.getvalue())
+        self.lastsync = now
 
     def handleParameterRequest(self, data):
         """ Send parameters to device. Supports only simple datatypes and arrays of such. """
@@ -911,17 +989,15 @@ class SerialClient(object):
 
         if param_exists:
             if isinstance(param, dict):
-                rospy.logerr("Cannot send param %s because it is a dictionary"%req.name)
+                rospy.logerr("Cannot send param %s because it is a dictionary", req.name)
             else:
                 if not isinstance(param, list):
                     param = [param]
 
                 #check to make sure that all parameters in list are same type
                 t = type(param[0])
-                for p in param:
-                    if t!= type(p):
-                        rospy.logerr('All Parameters in the list %s must be of the same type'%req.name)
-                        break
+                if any(type(p) is not t for p in param):
+                    rospy.logerr('All Parameters in the list %s must be of the same type', req.name)
                 else:
                     if t == int or t == bool:
                         resp.ints = param
@@ -932,14 +1008,14 @@ class SerialClient(object):
 
 
                     resp.exists = True
-                    rospy.loginfo('Requesting param %s'%req.name)
+                    rospy.loginfo('Requesting param %s', req.name)
                     
         else:
-            rospy.logerr("Parameter %s does not exist"%req.name)
+            rospy.logerr("Parameter %s does not exist", req.name)
 
-        data_buffer = io.BytesIO()
-        resp.serialize(data_buffer)
-        self.send(TopicInfo.ID_PARAMETER_REQUEST, data_buffer.getvalue())
+        self.reply_buffer.reset()
+        resp.serialize(self.reply_buffer)
+        self.send(TopicInfo.ID_PARAMETER_REQUEST, self.reply_buffer.getvalue())
 
     def handleLoggingRequest(self, data):
         """ Forward logging information from serial device into ROS. """
@@ -963,7 +1039,16 @@ class SerialClient(object):
         """
         Queues data to be written to the serial port.
         """
-        self.write_queue.put((topic, msg))
+        self.write_queue.append((topic, msg))
+        self.write_event.set()
+
+    def sendPriority(self, topic, msg):
+        """
+        Queues data to be written ahead of anything already queued.
+        Used for replies the device is waiting on, such as time sync.
+        """
+        self.write_queue.appendleft((topic, msg))
+        self.write_event.set()
 
     def _write(self, data):
         """
@@ -971,75 +1056,93 @@ class SerialClient(object):
         """
         with self.write_lock:
             self.port.write(data)
-            self.last_write = rospy.Time.now()
+            self.last_write = self.now()
 
-    def _send(self, topic, msg_bytes):
+    def _frame(self, buf, topic, msg_bytes):
         """
-        Send a message on a particular topic to the device.
+        Append the frame for a message on a particular topic to buf. msg_bytes may be any
+        contiguous buffer (bytes, bytearray, memoryview). Returns the message length, or -1
+        if the message was dropped.
         """
+        # a byte view gives the length in bytes and is summed and copied without concatenation
+        msg_bytes = memoryview(msg_bytes).cast('B')
         length = len(msg_bytes)
         if self.buffer_in > 0 and length > self.buffer_in:
-            rospy.logerr("Message from ROS network dropped: message larger than buffer.\n%s" % msg)
+            rospy.logerr("Message from ROS network dropped: message of %d bytes larger than buffer of %d bytes", length, self.buffer_in)
             return -1
         else:
             # frame : header (1b) + version (1b) + msg_len(2b) + msg_len_chk(1b) + topic_id(2b) + msg(nb) + msg_topic_id_chk(1b)
-            length_bytes = struct.pack('<h', length)
-            length_checksum = 255 - (sum(array.array('B', length_bytes)) % 256)
-            length_checksum_bytes = struct.pack('B', length_checksum)
-
-            topic_bytes = struct.pack('<h', topic)
-            msg_checksum = 255 - (sum(array.array('B', topic_bytes + msg_bytes)) % 256)
-            msg_checksum_bytes = struct.pack('B', msg_checksum)
-
-            self._write(self.header + self.protocol_ver + length_bytes + length_checksum_bytes + topic_bytes + msg_bytes + msg_checksum_bytes)
+            append_frame(buf, self.frame_prefix, topic, msg_bytes)
             return length
 
+    def _flush(self, data):
+        """
+        Write a batch of frames to the serial port with a single write call.
+        """
+        while True:
+            try:
+                self._write(data)
+                break
+            except SerialTimeoutException as exc:
+                rospy.logerr('Write timeout: %s', exc)
+                time.sleep(1)
+            except RuntimeError as exc:
+                rospy.logerr('Write thread exception: %s', exc)
+                break
+
     def processWriteQueue(self):
         """
         Main loop for the thread that processes outgoing data to write to the serial port.
+        Packets queued since the last wakeup are framed into one buffer and written at once,
+        without exceeding the port's max_write_size (if it has one) unless a single packet does.
+        Sleeps until data is queued and exits after writing what precedes WRITE_QUEUE_STOP.
         """
-        while not rospy.is_shutdown():
-            if self.write_queue.empty():
-                time.sleep(0.01)
-            else:
-                data = self.write_queue.get()
-                while True:
+        max_write_size = getattr(self.port, 'max_write_size', None)
+        stop = False
+        while not stop:
+            self.write_event.wait()
+            self.write_event.clear()
+            batch = bytearray()
+            for _ in range(len(self.write_queue)):
+                data = self.write_queue.popleft()
+                batch_size = len(batch)
+                if data is WRITE_QUEUE_STOP:
+                    stop = True
+                    break
+                elif isinstance(data, tuple):
+                    topic, msg = data
                     try:
-                        if isinstance(data, tuple):
-                            topic, msg = data
-                            self._send(topic, msg)
-                        elif isinstance(data, bytes):
-                            self._write(data)
-                        else:
-                            rospy.logerr("Trying to write invalid data type: %s" % type(data))
-                        break
-                    except SerialTimeoutException as exc:
-                        rospy.logerr('Write timeout: %s' % exc)
-                        time.sleep(1)
-                    except RuntimeError as exc:
-                        rospy.logerr('Write thread exception: %s' % exc)
-                        break
-
+                        self._frame(batch, topic, msg)
+                    except Exception as exc:
+                        # drop only this packet, and any part of its frame, not the batch
+                        del batch[batch_size:]
+                        rospy.logerr("Message from ROS network dropped on topic %s: %s", topic, exc)
+                        continue
+                elif isinstance(data, bytes):
+                    batch += data
+                else:
+                    rospy.logerr("Trying to write invalid data type: %s", type(data))
+                    continue
+                if batch_size and max_write_size is not None and len(batch) > max_write_size:
+                    # write out the packets before this one, it starts the next batch
+                    self._flush(batch[:batch_size])
+                    del batch[:batch_size]
+            if batch:
+                self._flush(batch)
 
     def sendDiagnostics(self, level, msg_text):
-        msg = diagnostic_msgs.msg.DiagnosticArray()
-        status = diagnostic_msgs.msg.DiagnosticStatus()
-        status.name = "rosserial_python"
-        msg.header.stamp = rospy.Time.now()
-        msg.status.append(status)
+        msg = self.diagnostics_msg
+        status = msg.status[0]
+        msg.header.stamp = self.now()
 
         status.message = msg_text
         status.level = level
 
-        status.values.append(diagnostic_msgs.msg.KeyValue())
-        status.values[0].key="last sync"
         if self.lastsync.to_sec()>0:
             status.values[0].value=time.ctime(self.lastsync.to_sec())
         else:
             status.values[0].value="never"
 
-        status.values.append(diagnostic_msgs.msg.KeyValue())
-        status.values[1].key="last sync lost"
         status.values[1].value=time.ctime(self.lastsync_lost.to_sec())
 
         self.pub_diagnostics.publish(msg)
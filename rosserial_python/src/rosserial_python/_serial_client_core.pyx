@@ -0,0 +1,89 @@
+# cython: language_level=3
+#####################################################################
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2011, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+    Compiled helpers for the packet parser and framer in SerialClient. This module is
+    optional: SerialClient falls back to pure Python versions when it is not built.
+"""
+
+import struct
+
+from cpython.bytearray cimport PyByteArray_AS_STRING, PyByteArray_GET_SIZE, PyByteArray_Resize
+from libc.string cimport memcpy
+
+cpdef unsigned long sum_bytes(const unsigned char[:] buf):
+    """ Sum the bytes of a buffer. """
+    cdef Py_ssize_t i
+    cdef unsigned long total = 0
+    for i in range(buf.shape[0]):
+        total += buf[i]
+    return total
+
+cpdef tuple unpack_length(const unsigned char[:] buf):
+    """ Decode the message length header, returns (length, checksum ok). """
+    cdef short length = <short>(buf[0] | (buf[1] << 8))
+    return length, ((buf[0] + buf[1] + buf[2]) & 0xff) == 255
+
+cpdef unsigned short unpack_topic(const unsigned char[:] buf):
+    """ Decode the topic id header. """
+    return buf[0] | (buf[1] << 8)
+
+cpdef append_frame(bytearray buf, bytes prefix, int topic, const unsigned char[::1] msg):
+    """ Append the frame carrying msg on topic to buf, msg must be contiguous. """
+    cdef Py_ssize_t length = msg.shape[0]
+    cdef Py_ssize_t prefix_len = len(prefix)
+    cdef Py_ssize_t start = PyByteArray_GET_SIZE(buf)
+    cdef Py_ssize_t i
+    cdef unsigned long msg_sum = (topic & 0xff) + ((topic >> 8) & 0xff)
+    cdef unsigned char* out
+
+    # msg_len and topic_id are int16, raise like the fallback's struct.pack instead of wrapping
+    if not -32768 <= topic <= 32767 or length > 32767:
+        raise struct.error("short format requires -32768 <= number <= 32767")
+
+    # prefix + msg_len(2b) + msg_len_chk(1b) + topic_id(2b) + msg(nb) + msg_topic_id_chk(1b)
+    PyByteArray_Resize(buf, start + prefix_len + length + 6)
+    out = <unsigned char*>PyByteArray_AS_STRING(buf) + start
+    memcpy(out, <char*>prefix, prefix_len)
+    out += prefix_len
+    out[0] = length & 0xff
+    out[1] = (length >> 8) & 0xff
+    out[2] = 255 - ((out[0] + out[1]) % 256)
+    out[3] = topic & 0xff
+    out[4] = (topic >> 8) & 0xff
+    if length > 0:
+        memcpy(&out[5], &msg[0], length)
+    for i in range(length):
+        msg_sum += msg[i]
+    out[5 + length] = 255 - (msg_sum % 256)
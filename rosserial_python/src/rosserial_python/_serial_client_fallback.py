@@ -0,0 +1,100 @@
+#####################################################################
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2011, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+    Pure Python versions of the packet parser and framer helpers in _serial_client_core,
+    used by SerialClient when the compiled module is not built.
+"""
+
+import struct
+
+# packet header fields, msg_len(2b) + msg_len_chk(1b) and topic_id(2b)
+LENGTH_HEADER = struct.Struct("<hB")
+TOPIC_HEADER = struct.Struct("<H")
+# msg_len and topic_id as written by append_frame
+INT16 = struct.Struct("<h")
+
+# below this many bytes the numpy call overhead outweighs its vectorized sum
+NUMPY_SUM_THRESHOLD = 4096
+
+# imported on the first sum over NUMPY_SUM_THRESHOLD, False if it is not installed
+_numpy = None
+
+def checksum(total):
+    """ Checksum byte for data whose bytes sum to total. """
+    return 255 - (total % 256)
+
+def sum_bytes(buf):
+    """ Sum the bytes of a buffer. Iterating a bytes object yields ints directly,
+        so the reduction runs in C without building an intermediate array. """
+    global _numpy
+    if len(buf) >= NUMPY_SUM_THRESHOLD:
+        if _numpy is None:
+            try:
+                import numpy as _numpy
+            except ImportError:
+                _numpy = False
+        if _numpy:
+            return int(_numpy.frombuffer(buf, dtype=_numpy.uint8).sum(dtype=_numpy.uint64))
+    return sum(buf)
+
+def unpack_length(buf):
+    """ Decode the message length header, returns (length, checksum ok). """
+    length, _ = LENGTH_HEADER.unpack(buf)
+    return length, (buf[0] + buf[1] + buf[2]) & 0xff == 255
+
+def unpack_topic(buf):
+    """ Decode the topic id header. """
+    topic_id, = TOPIC_HEADER.unpack(buf)
+    return topic_id
+
+# msg_len(2b) + msg_len_chk(1b) by message length, most topics repeat a few lengths
+length_headers = {}
+
+def append_frame(buf, prefix, topic, msg):
+    """ Append the frame carrying msg on topic to buf. """
+    length = len(msg)
+    length_header = length_headers.get(length)
+    if length_header is None:
+        length_bytes = INT16.pack(length)
+        length_header = length_bytes + bytes((checksum(length_bytes[0] + length_bytes[1]),))
+        length_headers[length] = length_header
+    topic_bytes = INT16.pack(topic)
+
+    # prefix + msg_len(2b) + msg_len_chk(1b) + topic_id(2b) + msg(nb) + msg_topic_id_chk(1b)
+    buf += prefix
+    buf += length_header
+    buf += topic_bytes
+    buf += msg
+    buf.append(checksum(topic_bytes[0] + topic_bytes[1] + sum_bytes(msg)))
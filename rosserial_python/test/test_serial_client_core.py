@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+    Checks the pure Python parser and framer helpers against known frames, and the
+    compiled helpers, when built, against the pure Python ones.
+"""
+
+import random
+import struct
+import unittest
+
+from rosserial_python import _serial_client_fallback as fallback
+
+try:
+    from rosserial_python import _serial_client_core as core
+except ImportError:
+    core = None
+
+PREFIX = b'\xff\xfe'
+TOPICS = (0, 10, 125, 255, 256, 1023, -1, 32767)
+SIZES = (0, 1, 2, 7, 255, 256, 1000, 4096, 5000, 32767)
+OUT_OF_RANGE = ((40000, 0), (-40000, 0), (10, 40000))
+
+
+class TestSerialClientFallback(unittest.TestCase):
+
+    def test_append_frame(self):
+        frame = bytearray()
+        fallback.append_frame(frame, PREFIX, 0, b'')
+        self.assertEqual(frame, b'\xff\xfe\x00\x00\xff\x00\x00\xff')
+
+        # appends to what is already in the buffer, here the tx stop request
+        fallback.append_frame(frame, PREFIX, 11, b'')
+        self.assertEqual(frame, b'\xff\xfe\x00\x00\xff\x00\x00\xff\xff\xfe\x00\x00\xff\x0b\x00\xf4')
+
+        frame = bytearray()
+        fallback.append_frame(frame, PREFIX, 10, b'\x01\x02\x03')
+        self.assertEqual(frame, b'\xff\xfe\x03\x00\xfc\x0a\x00\x01\x02\x03\xef')
+
+    def test_append_frame_out_of_range(self):
+        for topic, size in OUT_OF_RANGE:
+            with self.assertRaises(struct.error):
+                fallback.append_frame(bytearray(), PREFIX, topic, bytes(size))
+
+    def test_sum_bytes(self):
+        self.assertEqual(fallback.sum_bytes(b''), 0)
+        self.assertEqual(fallback.sum_bytes(b'\x01\x02\xff'), 258)
+        self.assertEqual(fallback.sum_bytes(b'\xff' * 5000), 255 * 5000)
+
+    def test_unpack_length(self):
+        self.assertEqual(fallback.unpack_length(b'\x00\x00\xff'), (0, True))
+        self.assertEqual(fallback.unpack_length(b'\x03\x00\xfc'), (3, True))
+        self.assertEqual(fallback.unpack_length(b'\x00\x01\xff'), (256, False))
+        self.assertEqual(fallback.unpack_length(b'\x03\x00\xfd'), (3, False))
+
+    def test_unpack_topic(self):
+        self.assertEqual(fallback.unpack_topic(b'\x0b\x00'), 11)
+        self.assertEqual(fallback.unpack_topic(b'\x00\x04'), 1024)
+
+
+@unittest.skipIf(core is None, "_serial_client_core is not built, set ROSSERIAL_PYTHON_CYTHON")
+class TestSerialClientCore(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def payload(self, size):
+        return bytes(self.random.getrandbits(8) for _ in range(size))
+
+    def test_sum_bytes(self):
+        for size in SIZES:
+            data = self.payload(size)
+            self.assertEqual(core.sum_bytes(data), fallback.sum_bytes(data))
+            self.assertEqual(core.sum_bytes(bytearray(data)), fallback.sum_bytes(bytearray(data)))
+
+    def test_unpack_length(self):
+        for header in (b'\x00\x00\xff', b'\x06\x00\xf9', b'\x06\x00\xf8', b'\xff\x7f\x80', b'\xff\xff\x01'):
+            self.assertEqual(core.unpack_length(header), fallback.unpack_length(header))
+        for _ in range(1000):
+            header = self.payload(3)
+            self.assertEqual(core.unpack_length(header), fallback.unpack_length(header))
+
+    def test_unpack_topic(self):
+        for topic in range(0, 0x10000, 257):
+            header = bytes((topic & 0xff, topic >> 8))
+            self.assertEqual(core.unpack_topic(header), fallback.unpack_topic(header))
+
+    def test_append_frame(self):
+        for topic in TOPICS:
+            for size in SIZES:
+                msg = self.payload(size)
+                for data in (msg, bytearray(msg), memoryview(msg)):
+                    expected = bytearray(b'queued')
+                    fallback.append_frame(expected, PREFIX, topic, data)
+                    frame = bytearray(b'queued')
+                    core.append_frame(frame, PREFIX, topic, data)
+                    self.assertEqual(frame, expected)
+
+    def test_append_frame_out_of_range(self):
+        for topic, size in OUT_OF_RANGE:
+            for helpers in (fallback, core):
+                frame = bytearray(b'queued')
+                with self.assertRaises(struct.error):
+                    helpers.append_frame(frame, PREFIX, topic, bytes(size))
+                self.assertEqual(frame, b'queued')
+
+    def test_append_frame_rejects_strided(self):
+        with self.assertRaises(BufferError):
+            core.append_frame(bytearray(), PREFIX, 10, memoryview(b'abcdef')[::2])
+
+
+if __name__ == '__main__':
+    unittest.main()